@@ -12,10 +12,30 @@ import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk
 import io
+import sys
+import random
+import tempfile
+import tracemalloc
+import logging
+from collections import Counter, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging.handlers import RotatingFileHandler
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import psutil  # Опційно: RSS та дочірні процеси Playwright
+except ImportError:
+    psutil = None
+
 TOKEN_FILE = 'token.json'
 
 # === КОНФІГУРАЦІЯ ===
@@ -23,14 +43,59 @@ START_TIME = None  # Час початку моніторингу (HH:MM:SS), No
 MONITOR_DURATION_MINUTES = 720  # Скільки хвилин працює моніторинг
 CHECK_INTERVAL_SECONDS = 60  # Інтервал перевірки в секундах
 TOKEN_CACHE_SECONDS = 180  # Кешування токена на 3 хвилини
+TOKEN_REFRESH_BACKOFF_SECONDS = 30  # Пауза після невдалого оновлення токена (для всіх процесів)
 TOKEN_PREPARE_SECONDS = 30  # За скільки секунд до старту отримати токен
 MAX_RETRIES = 3  # Максимальна кількість спроб при помилці
 CSV_FILE = 'inventory_log.csv'  # Файл для збереження даних
 REQUEST_TIMEOUT = 10  # Таймаут для HTTP запитів
 PLAYWRIGHT_TIMEOUT = 5000  # Таймаут для Playwright (мс)
+TOKEN_POOL_SIZE = 3  # Кількість незалежних токенів у пулі
+PROFILE_DIR = 'profiles'  # Папка для звітів профайлера
+PROFILE_SAMPLE_INTERVAL = 0.02  # Інтервал семплювання стеків (с)
+PROFILE_REPORT_SECONDS = 300  # Як часто писати звіт CPU/пам'яті
+PROFILE_TOP_N = 20  # Скільки рядків у кожному топі звіту
+PROFILE_LOG_MAX_BYTES = 5 * 1024 * 1024  # Розмір одного файлу звіту
+PROFILE_LOG_BACKUPS = 5  # Скільки старих файлів звіту зберігати
+SIGNAL_POLL_MS = 250  # Як часто mainloop віддає керування обробникам сигналів
+WATCHLIST_FILE = 'watchlist.json'  # Списки продуктів для відстеження
+CATALOG_CACHE_FILE = 'catalog_cache.json'  # Кеш метаданих продуктів
+CATALOG_CACHE_TTL_SECONDS = 24 * 3600  # Скільки живе запис у кеші каталогу
+CATALOG_REFRESH_SECONDS = 3600  # Як часто фоновий потік перевіряє кеш
+STOREFRONT_URL = 'https://creations.mattel.com'  # Shopify storefront для метаданих
+CATALOG_PAGE_LIMIT = 250  # Продуктів на сторінку /products.json (максимум Shopify)
+CATALOG_MAX_PAGES = 40  # Запобіжник для пагінації
+ROLLUP_TIERS = [('1m', 60), ('5m', 300), ('1h', 3600)]  # Рівні агрегації історії (назва, секунди)
+ROLLUP_MAX_BUCKETS = 2000  # Скільки закритих бакетів кожного рівня тримати в пам'яті на продукт
+GRAPH_MAX_POINTS = 120  # Понад цю кількість сирих точок графік будується з агрегатів
+SIMULATED_ID_BASE = 1_000_000_000_000  # Діапазон ID синтетичних продуктів
+SIM_CSV_FILE = 'inventory_log_sim.csv'  # Лог симуляції (окремо від реального)
+SIM_CATALOG_CACHE_FILE = 'catalog_cache_sim.json'  # Кеш каталогу симуляції
+STRESS_PROBE_MS = 100  # Період проби затримки циклу подій Tk
+STRESS_REPORT_SECONDS = 5  # Як часто виводити звіт стрес-режиму
+HEDGE_DEFAULT_CUTOFF = 2.0  # Поріг дубля запиту (с), поки не набрано статистики
+HEDGE_MIN_CUTOFF = 0.3  # Нижня межа порогу дубля (с)
+HEDGE_MIN_SAMPLES = 20  # Скільки відповідей треба для власного p95
+HEDGE_WINDOW = 200  # Ковзне вікно затримок для p95
+HEDGE_MAX_WORKERS = 8  # Потоки для основних та дубльованих запитів
+
+# Профілі браузера для пулу токенів (кожен токен - окремий контекст)
+BROWSER_PROFILES = [
+    {
+        "user_agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+        "viewport": {'width': 1920, 'height': 1080}
+    },
+    {
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+        "viewport": {'width': 1536, 'height': 864}
+    },
+    {
+        "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+        "viewport": {'width': 1366, 'height': 768}
+    },
+]
 
-# Конфігурація продуктів
-PRODUCTS = {
+# Вбудовані метадані продуктів (запасний варіант, якщо немає кешу/мережі)
+DEFAULT_PRODUCTS = {
     9083040727245: {
         "name": "Hot Wheels x Daniel Arsham 1973 Porsche 911 RSA",
         "image_url": "https://cdn.shopify.com/s/files/1/0568/1132/3597/files/wr9xdfnipg3tnyglifpn.jpg"
@@ -56,13 +121,19 @@ PRODUCTS = {
 # Флаг для graceful shutdown
 shutdown_flag = False
 
+# Пул потоків для хеджованих запитів і лічильник вільних потоків у ньому
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS)
+HEDGE_SLOTS = threading.BoundedSemaphore(HEDGE_MAX_WORKERS)
+
 
 class ProductColumn:
     """Клас для однієї колонки продукту"""
 
-    def __init__(self, parent, column_id):
+    def __init__(self, parent, column_id, catalog):
         self.column_id = column_id
+        self.catalog = catalog
         self.product_id = None
+        self.image_url = None
         self.initial_qty = None
         self.current_qty = None
         self.max_qty = None
@@ -85,12 +156,10 @@ class ProductColumn:
         ).pack(side=tk.LEFT, padx=5)
 
         self.product_var = tk.StringVar()
-        product_options = [''] + [f"{pid} - {PRODUCTS[pid]['name'].split(chr(10))[0]}" for pid in PRODUCTS.keys()]
-
         self.product_selector = ttk.Combobox(
             selector_frame,
             textvariable=self.product_var,
-            values=product_options,
+            values=self.product_options(),
             state='readonly',
             width=30
         )
@@ -215,6 +284,30 @@ class ProductColumn:
         )
         self.change_label.pack()
 
+    def product_options(self):
+        """Пункти випадаючого меню з каталогу"""
+        return [''] + [self.option_label(pid) for pid in self.catalog.product_ids]
+
+    def option_label(self, product_id):
+        """Текст пункту меню для продукту"""
+        return f"{product_id} - {self.catalog.name(product_id)}"
+
+    def select_product(self, product_id):
+        """Програмно вибирає продукт"""
+        self.product_var.set(self.option_label(product_id))
+        self.on_product_selected()
+
+    def refresh_catalog(self):
+        """Оновлює меню і назву/фото після оновлення каталогу"""
+        self.product_selector.configure(values=self.product_options())
+        if self.product_id is not None:
+            self.product_var.set(self.option_label(self.product_id))
+            product_info = self.catalog.get(self.product_id)
+            self.title_label.configure(text=product_info.get('name', 'Unknown'))
+            # Фото перезавантажуємо лише якщо змінилось посилання
+            if product_info.get('image_url') != self.image_url:
+                self.load_product_image(product_info.get('image_url'))
+
     def on_product_selected(self, event=None):
         """Обробка вибору продукту"""
         selection = self.product_var.get()
@@ -230,7 +323,7 @@ class ProductColumn:
 
     def load_product(self, product_id):
         """Завантажує інформацію про продукт"""
-        product_info = PRODUCTS.get(product_id, {})
+        product_info = self.catalog.get(product_id)
 
         # Встановлюємо назву
         self.title_label.configure(text=product_info.get('name', 'Unknown'))
@@ -243,6 +336,12 @@ class ProductColumn:
 
     def load_product_image(self, url):
         """Завантажує та відображає фото продукту"""
+        if not url:
+            self.image_url = None
+            self.image_label.configure(image='', text="No image", fg='#666666')
+            self.image_label.image = None
+            return
+
         try:
             response = requests.get(url, timeout=5)
             image_data = Image.open(io.BytesIO(response.content))
@@ -250,7 +349,10 @@ class ProductColumn:
             photo = ImageTk.PhotoImage(image_data)
             self.image_label.configure(image=photo)
             self.image_label.image = photo
+            # Запам'ятовуємо лише успішне завантаження, щоб оновлення каталогу повторило невдале
+            self.image_url = url
         except Exception as e:
+            self.image_url = None
             self.image_label.configure(text="❌ Error", fg='#ff0000')
             print(f"Помилка завантаження фото: {e}")
 
@@ -301,8 +403,17 @@ class ProductColumn:
 
 
 class InventoryMonitorGUI:
-    def __init__(self, root):
+    def __init__(self, root, catalog, rollups, profiler=None, simulation=None, stress=None,
+                 column_count=3, check_interval=CHECK_INTERVAL_SECONDS):
         self.root = root
+        self.catalog = catalog
+        self.rollups = rollups
+        self.profiler = profiler
+        self.simulation = simulation
+        self.stress = stress
+        self.column_count = column_count
+        self.check_interval = check_interval
+        self.latency = LatencyTracker()
         self.root.title("Mattel Multi-Product Inventory Monitor")
         self.root.geometry("1400x800")
         self.root.configure(bg='#1a1a1a')
@@ -312,6 +423,8 @@ class InventoryMonitorGUI:
         self.columns = []
 
         self.setup_ui()
+        self.root.bind('<Control-p>', self.toggle_profiling)
+        self.catalog.add_listener(lambda: self.root.after(0, self.on_catalog_updated))
 
     def setup_ui(self):
         # Головний контейнер
@@ -332,18 +445,18 @@ class InventoryMonitorGUI:
         columns_frame = tk.Frame(main_frame, bg='#1a1a1a')
         columns_frame.pack(fill=tk.BOTH, expand=True)
 
-        # Створюємо 3 колонки
-        for i in range(3):
-            column = ProductColumn(columns_frame, i + 1)
+        # Створюємо колонки
+        for i in range(self.column_count):
+            column = ProductColumn(columns_frame, i + 1, self.catalog)
             column.frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
             self.columns.append(column)
 
-            # За замовчуванням показуємо тільки першу колонку
-            if i == 0:
-                # Вибираємо перший продукт
-                first_product = list(PRODUCTS.keys())[0]
-                column.product_var.set(f"{first_product} - {PRODUCTS[first_product]['name'].split(chr(10))[0]}")
-                column.on_product_selected()
+            if self.simulation is not None and i < len(self.catalog.product_ids):
+                # Симуляція - колонки показують перші продукти, опитуються всі
+                column.select_product(self.catalog.product_ids[i])
+            elif i == 0 and self.catalog.product_ids:
+                # За замовчуванням показуємо тільки першу колонку з першим продуктом
+                column.select_product(self.catalog.product_ids[0])
 
         # Статус
         self.status_label = tk.Label(
@@ -369,12 +482,12 @@ class InventoryMonitorGUI:
         self.graphs_frame = tk.Frame(main_frame, bg='#2a2a2a')
         self.graphs_frame.pack(fill=tk.BOTH, expand=True, pady=10)
 
-        # Створюємо 3 графіки (по одному для кожної колонки)
+        # Створюємо графіки (по одному для кожної колонки)
         self.figures = []
         self.axes = []
         self.canvases = []
 
-        for i in range(3):
+        for i in range(self.column_count):
             graph_container = tk.Frame(self.graphs_frame, bg='#2a2a2a')
             graph_container.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
 
@@ -432,13 +545,22 @@ class InventoryMonitorGUI:
         # Видалено - тепер графіки показуються для всіх колонок
         pass
 
+    def on_catalog_updated(self):
+        """Каталог оновився у фоні - оновлюємо меню та назви"""
+        for idx, column in enumerate(self.columns):
+            column.refresh_catalog()
+            self.update_graph_for_column(idx)
+
     def update_stats_for_product(self, product_id, qty, max_qty=None):
         """Оновлює статистику для конкретного продукту"""
         for idx, column in enumerate(self.columns):
             if column.product_id == product_id:
                 column.update_stats(qty, max_qty)
                 # Оновлюємо графік для цієї колонки
+                started = time.perf_counter()
                 self.update_graph_for_column(idx)
+                if self.stress is not None:
+                    self.stress.record_redraw(idx, time.perf_counter() - started)
 
     def update_graph_for_column(self, column_idx):
         """Оновлює графік для конкретної колонки"""
@@ -463,11 +585,26 @@ class InventoryMonitorGUI:
             return
 
         # Отримуємо назву продукту для заголовка
-        product_name = PRODUCTS.get(column.product_id, {}).get('name', 'Unknown').split('\n')[0]
+        product_name = self.catalog.name(column.product_id)
         ax.set_title(product_name, color='#ffffff', fontsize=9, pad=5)
 
         timestamps = column.timestamps
         quantities = column.quantities
+        band = None
+
+        # Довга історія - малюємо з агрегатів, але лише коли навіть найдрібніший
+        # рівень дає не менше GRAPH_MAX_POINTS бакетів (при частому опитуванні
+        # коротке вікно інакше стиснулось би до кількох точок)
+        window_start = timestamps[0].timestamp()
+        window_end = time.time()
+        finest_seconds = self.rollups.tiers[0][1]
+        if len(timestamps) > GRAPH_MAX_POINTS and (window_end - window_start) / finest_seconds >= GRAPH_MAX_POINTS:
+            tier, buckets = self.rollups.query(column.product_id, window_start, window_end, GRAPH_MAX_POINTS)
+            if buckets:
+                timestamps = [datetime.fromtimestamp(b['start']) for b in buckets]
+                quantities = [b['last'] for b in buckets]
+                band = ([b['min'] for b in buckets], [b['max'] for b in buckets])
+                ax.set_title(f"{product_name} ({tier})", color='#ffffff', fontsize=9, pad=5)
 
         # Якщо точок багато (>15), групуємо їх для кращої читабельності
         max_points = 15
@@ -509,6 +646,11 @@ class InventoryMonitorGUI:
             ax.set_xticks(range(len(quantities)))
             ax.set_xticklabels(time_labels, rotation=45, ha='right')
 
+        # Діапазон min/max всередині бакетів
+        if band:
+            ax.fill_between(range(len(quantities)), band[0], band[1],
+                            alpha=0.35, color='#FF9800', linewidth=0)
+
         ax.set_facecolor('#1a1a1a')
         ax.set_xlabel('Time', color='#ffffff', fontsize=7)
         ax.set_ylabel('Qty', color='#ffffff', fontsize=7)
@@ -518,6 +660,15 @@ class InventoryMonitorGUI:
         figure.tight_layout()
         canvas.draw()
 
+    def toggle_profiling(self, event=None):
+        """Вмикає/вимикає профайлер під час роботи (Ctrl+P)"""
+        if self.profiler is None:
+            return
+        if self.profiler.toggle():
+            self.update_status(f"🩺 Profiling ON → {self.profiler.output_dir}", '#9C27B0')
+        else:
+            self.update_status("🩺 Profiling OFF", '#aaaaaa')
+
     def update_status(self, message, color='#aaaaaa'):
         """Оновлює статус"""
         self.status_label.configure(text=message, fg=color)
@@ -552,26 +703,49 @@ class InventoryMonitorGUI:
         self.stop_button.configure(state=tk.DISABLED)
         self.update_status("STOPPED", '#FF9800')
 
+    def fetch_inventory(self, token_pool, product_id):
+        """Дані інвентаря з симуляції або з API через пул токенів"""
+        if self.simulation is not None:
+            return self.simulation.get_inventory(None, product_id)
+        return self.fetch_with_pool(token_pool, product_id)
+
+    def fetch_with_pool(self, token_pool, product_id):
+        """Хеджований запит через пул токенів з повтором на іншому токені"""
+        for _ in range(2):
+            if token_pool.active_count() == 0:
+                # Живих токенів немає - чекаємо на синхронне оновлення
+                token_pool.refresh_one()
+                if token_pool.active_count() == 0:
+                    return None
+
+            # Відмови авторизації get_inventory_hedged сам виводить з ротації і оновлює;
+            # тут failed_tokens лише вирішують, чи є сенс повторити з іншим токеном
+            data, failed_tokens = get_inventory_hedged(token_pool, product_id, self.latency)
+
+            if data or not failed_tokens:
+                # Успіх або лише повільні/серверні помилки - токени в порядку, повтор не допоможе
+                return data
+
+        return None
+
     def run_monitor(self):
         """Основна логіка моніторингу"""
         global shutdown_flag
         shutdown_flag = False
 
-        self.update_status("🔑 Getting token...", '#2196F3')
-
         init_csv()
-        token = load_token()
+        token_pool = None
 
-        if not token:
-            token = get_token_with_playwright()
-            if token:
-                save_token(token)
-            else:
-                self.update_status("❌ Error on token", '#f44336')
-                self.monitoring = False
-                self.root.after(0, lambda: self.start_button.configure(state=tk.NORMAL))
-                self.root.after(0, lambda: self.stop_button.configure(state=tk.DISABLED))
-                return
+        if self.simulation is None:
+            self.update_status("🔑 Getting token...", '#2196F3')
+            token_pool = TokenPool()
+
+        if token_pool is not None and not token_pool.fill():
+            self.update_status("❌ Error on token", '#f44336')
+            self.monitoring = False
+            self.root.after(0, lambda: self.start_button.configure(state=tk.NORMAL))
+            self.root.after(0, lambda: self.stop_button.configure(state=tk.DISABLED))
+            return
 
         self.update_status("✅ Monitoring started", '#4CAF50')
 
@@ -581,59 +755,38 @@ class InventoryMonitorGUI:
         previous_qtys = {}
         check_count = 0
 
-        # Отримуємо список активних продуктів
-        active_products = [col.product_id for col in self.columns if col.product_id is not None]
+        # Отримуємо список активних продуктів (у симуляції - всі, незалежно від кількості колонок)
+        if self.simulation is not None:
+            active_products = self.simulation.product_ids
+        else:
+            active_products = [col.product_id for col in self.columns if col.product_id is not None]
 
         while time.time() < end_time and not shutdown_flag and self.monitoring:
             check_count += 1
-            remaining = int((end_time - time.time()) / 60)
+            cycle_start = time.time()
+            remaining = int((end_time - cycle_start) / 60)
 
             self.root.after(0, lambda: self.update_status(
                 f"🔄 Check #{check_count} (~{remaining} min left)", '#2196F3'
             ))
 
-            # Перевіряємо токен
-            if not token:
-                token = load_token()
-                if not token:
-                    token = get_token_with_playwright()
-                    if token:
-                        save_token(token)
-
             # Отримуємо дані для кожного активного продукту
             for product_id in active_products:
-                data = get_inventory(token, product_id)
+                data = self.fetch_inventory(token_pool, product_id)
 
-                if data and data.get('totalInventory') is not None:
+                if data:
                     qty = data.get('totalInventory')
                     max_qty = data.get('maxQuantity')
-                    previous_qtys[product_id] = log_inventory(data, previous_qtys.get(product_id), product_id)
+                    previous_qtys[product_id] = log_inventory(data, previous_qtys.get(product_id), product_id,
+                                                             self.catalog.get(product_id).get('name', 'Unknown'))
+                    self.rollups.add(product_id, data['timestamp'], qty)
 
                     # Оновлюємо GUI
                     self.root.after(0,
                                     lambda pid=product_id, q=qty, mq=max_qty: self.update_stats_for_product(pid, q, mq))
                     consecutive_failures = 0
                 else:
-                    # Оновлюємо токен при помилці
-                    new_token = get_token_with_playwright()
-                    if new_token:
-                        token = new_token
-                        save_token(token)
-
-                        data = get_inventory(token, product_id)
-                        if data and data.get('totalInventory') is not None:
-                            qty = data.get('totalInventory')
-                            max_qty = data.get('maxQuantity')
-                            previous_qtys[product_id] = log_inventory(data, previous_qtys.get(product_id), product_id)
-                            self.root.after(0,
-                                            lambda pid=product_id, q=qty, mq=max_qty: self.update_stats_for_product(pid,
-                                                                                                                    q,
-                                                                                                                    mq))
-                            consecutive_failures = 0
-                        else:
-                            consecutive_failures += 1
-                    else:
-                        consecutive_failures += 1
+                    consecutive_failures += 1
 
                     if consecutive_failures >= MAX_RETRIES:
                         self.root.after(0, lambda: self.update_status(
@@ -641,12 +794,18 @@ class InventoryMonitorGUI:
                         ))
                         break
 
-            # Чекаємо до наступної ітерації
-            for _ in range(CHECK_INTERVAL_SECONDS):
-                if shutdown_flag or not self.monitoring:
+            if self.stress is not None:
+                self.stress.record_cycle(time.time() - cycle_start)
+
+            # Чекаємо до наступної ітерації (інтервал рахується від початку перевірки)
+            next_check = cycle_start + self.check_interval
+            while not shutdown_flag and self.monitoring:
+                remaining = next_check - time.time()
+                if remaining <= 0:
                     break
-                time.sleep(1)
+                time.sleep(min(1, remaining))
 
+        self.rollups.flush()
         self.monitoring = False
         self.root.after(0, lambda: self.start_button.configure(state=tk.NORMAL))
         self.root.after(0, lambda: self.stop_button.configure(state=tk.DISABLED))
@@ -655,27 +814,901 @@ class InventoryMonitorGUI:
         ))
 
 
-# === ДОПОМІЖНІ ФУНКЦІЇ ===
+# === ПУЛ ТОКЕНІВ ===
+
+class TokenPool:
+    """Пул незалежних токенів, кожен зі свого браузерного профілю"""
 
-def load_token():
-    if os.path.exists(TOKEN_FILE):
+    def __init__(self, size=TOKEN_POOL_SIZE):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()  # Оновлюємо по одному слоту за раз
+        self.slots = []
+
+        for i in range(size):
+            self.slots.append({
+                'profile': BROWSER_PROFILES[i % len(BROWSER_PROFILES)],
+                'token_file': TOKEN_FILE if i == 0 else f'token_{i}.json',
+                'token': None,
+                'failed': False,
+                'last_used': 0,
+            })
+
+    def fill(self):
+        """Заповнює пул: кеш, далі один токен через Playwright, решта у фоні"""
+        for slot in self.slots:
+            slot['token'] = load_token(slot['token_file'])
+
+        if self.active_count() == 0:
+            # Для старту достатньо одного токена
+            with self.refresh_lock:
+                for slot in self.slots:
+                    if self.refresh_slot(slot):
+                        break
+
+        self.refresh_in_background()
+        return self.active_count() > 0
+
+    def active_count(self):
+        """Кількість робочих токенів"""
+        with self.lock:
+            return sum(1 for slot in self.slots if slot['token'] and not slot['failed'])
+
+    def acquire(self):
+        """Повертає (token, user_agent) слоту, який найдовше не використовувався"""
+        with self.lock:
+            active = [slot for slot in self.slots if slot['token'] and not slot['failed']]
+            if not active:
+                return None, None
+
+            slot = min(active, key=lambda s: s['last_used'])
+            slot['last_used'] = time.time()
+            return slot['token'], slot['profile']['user_agent']
+
+    def report_failure(self, token):
+        """Виводить токен з ротації до оновлення"""
+        with self.lock:
+            for slot in self.slots:
+                if slot['token'] == token:
+                    slot['failed'] = True
+
+    def refresh_slot(self, slot):
+        """Отримує новий токен для слоту (спільно з іншими процесами)"""
+        token = refresh_shared_token(slot['token_file'], slot['profile'], stale_token=slot['token'])
+        if not token:
+            return False
+
+        with self.lock:
+            slot['token'] = token
+            slot['failed'] = False
+            slot['last_used'] = 0
+        return True
+
+    def next_pending(self, attempted=()):
+        """Перший вибулий слот, який ще не пробували оновити з тим самим токеном"""
+        with self.lock:
+            for index, slot in enumerate(self.slots):
+                if (slot['token'] is None or slot['failed']) and (index, slot['token']) not in attempted:
+                    return index, slot
+        return None, None
+
+    def refresh_one(self):
+        """Синхронно оновлює перший вибулий слот (не більше одного оновлення одночасно)"""
+        with self.refresh_lock:
+            _, slot = self.next_pending()
+            if slot is None:
+                return True
+            return self.refresh_slot(slot)
+
+    def refresh_pending(self):
+        """Фоновий воркер: по одному оновлює всі вибулі слоти"""
+        attempted = set()
+        while self.refresh_lock.acquire(blocking=False):
+            try:
+                while True:
+                    index, slot = self.next_pending(attempted)
+                    if slot is None:
+                        break
+                    # Невдалий слот не крутимо по колу; новий збій змінить токен і ключ
+                    attempted.add((index, slot['token']))
+                    self.refresh_slot(slot)
+            finally:
+                self.refresh_lock.release()
+
+            # Слот міг вибути, поки лок був зайнятий, а його воркер одразу вийшов
+            if self.next_pending(attempted)[1] is None:
+                break
+
+    def refresh_in_background(self):
+        """Запускає оновлення вибулих слотів у фоновому потоці"""
+        threading.Thread(target=self.refresh_pending, daemon=True).start()
+
+
+# === КАТАЛОГ ПРОДУКТІВ ===
+
+class Catalog:
+    """Метадані продуктів: кеш на диску з TTL і фонове масове оновлення"""
+
+    def __init__(self, product_ids, fetcher=None, cache_file=CATALOG_CACHE_FILE, ttl=CATALOG_CACHE_TTL_SECONDS):
+        self.product_ids = list(product_ids)
+        self.fetcher = fetcher or fetch_storefront_metadata
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.listeners = []
+        self.refresh_thread = None
+        self.load_cache()
+
+    def load_cache(self):
+        """Читає кеш метаданих з диску"""
         try:
-            with open(TOKEN_FILE, 'r') as f:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                if time.time() - data['updated'] < TOKEN_CACHE_SECONDS:
-                    return data['token']
-        except:
-            pass
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Помилка читання кешу каталогу: {e}")
+            return
+
+        with self.lock:
+            for pid, entry in data.get('products', {}).items():
+                self.entries[int(pid)] = entry
+
+    def save_cache(self):
+        """Атомарно зберігає кеш метаданих"""
+        with self.lock:
+            data = {'products': {str(pid): entry for pid, entry in self.entries.items()}}
+        write_json_atomic(self.cache_file, data)
+
+    def get(self, product_id):
+        """Метадані продукту: кеш → вбудовані → заглушка"""
+        with self.lock:
+            entry = self.entries.get(product_id)
+        if entry:
+            return entry
+        return DEFAULT_PRODUCTS.get(product_id, {'name': f"Product {product_id}", 'image_url': None})
+
+    def name(self, product_id):
+        """Коротка назва продукту (перший рядок)"""
+        return self.get(product_id).get('name', 'Unknown').split('\n')[0]
+
+    def add_listener(self, callback):
+        """Колбек після оновлення каталогу (викликається з фонового потоку)"""
+        self.listeners.append(callback)
+
+    def stale_ids(self):
+        """ID продуктів без запису в кеші або з простроченим записом"""
+        now = time.time()
+        with self.lock:
+            return [pid for pid in self.product_ids
+                    if pid not in self.entries or now - self.entries[pid].get('updated', 0) >= self.ttl]
+
+    def refresh(self):
+        """Одним масовим запитом оновлює всі прострочені записи"""
+        stale = self.stale_ids()
+        if not stale:
+            return False
+
+        try:
+            fetched = self.fetcher(stale)
+        except Exception as e:
+            print(f"Помилка оновлення каталогу: {e}")
+            return False
+
+        now = time.time()
+        for pid in stale:
+            # Відсутні у відповіді теж позначаємо, щоб не шукати їх щоразу
+            meta = fetched.get(pid) or self.get(pid)
+            entry = {'name': meta.get('name', 'Unknown'), 'image_url': meta.get('image_url'), 'updated': now}
+            with self.lock:
+                self.entries[pid] = entry
+
+        self.save_cache()
+        for callback in self.listeners:
+            callback()
+        return True
+
+    def start_background_refresh(self, interval=CATALOG_REFRESH_SECONDS):
+        """Фоновий потік, що періодично оновлює прострочені записи"""
+        if self.refresh_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.refresh()
+                time.sleep(interval)
+
+        self.refresh_thread = threading.Thread(target=loop, daemon=True)
+        self.refresh_thread.start()
+
+
+def load_watchlists(watchlist_file=WATCHLIST_FILE):
+    """Списки відстеження з конфіг-файлу: {"watchlists": {"name": [product_id, ...]}}"""
+    default = {'default': list(DEFAULT_PRODUCTS.keys())}
+    try:
+        with open(watchlist_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        print(f"Помилка читання {watchlist_file}: {e}")
+        return default
+
+    raw_watchlists = data.get('watchlists') if isinstance(data, dict) else None
+    if not isinstance(raw_watchlists, dict):
+        print(f"Помилка у {watchlist_file}: 'watchlists' має бути об'єктом {{назва: [ID, ...]}}")
+        return default
+
+    watchlists = {}
+    for name, ids in raw_watchlists.items():
+        if not isinstance(ids, list):
+            print(f"Помилка у {watchlist_file}: список '{name}' має бути масивом ID, пропускаємо")
+            continue
+
+        product_ids = []
+        for pid in ids:
+            try:
+                product_ids.append(int(pid))
+            except (TypeError, ValueError):
+                print(f"Помилка у {watchlist_file}: некоректний ID {pid!r} у списку '{name}', пропускаємо")
+        watchlists[name] = product_ids
+
+    return watchlists or default
+
+
+def fetch_storefront_metadata(product_ids):
+    """Масово отримує назви і фото з Shopify storefront (/products.json посторінково)"""
+    wanted = set(product_ids)
+    found = {}
+
+    for page in range(1, CATALOG_MAX_PAGES + 1):
+        response = requests.get(
+            f"{STOREFRONT_URL}/products.json",
+            params={'limit': CATALOG_PAGE_LIMIT, 'page': page},
+            timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        products = response.json().get('products', [])
+        if not products:
+            break
+
+        for product in products:
+            if product.get('id') in wanted:
+                images = product.get('images') or []
+                found[product['id']] = {
+                    'name': product.get('title', 'Unknown'),
+                    'image_url': images[0].get('src') if images else None
+                }
+
+        if wanted <= found.keys():
+            break
+
+    return found
+
+
+def fetch_local_metadata(product_ids):
+    """Локальна заміна storefront (офлайн/тести): вбудовані метадані"""
+    return {pid: DEFAULT_PRODUCTS[pid] for pid in product_ids if pid in DEFAULT_PRODUCTS}
+
+
+# === АГРЕГАТИ ІСТОРІЇ ===
+
+class RollupStore:
+    """Інкрементальні агрегати історії (min/max/last/sold) для кількох рівнів"""
+
+    FIELDS = ['bucket_start', 'time', 'product_id', 'min', 'max', 'last', 'sold']
+
+    def __init__(self, tiers=ROLLUP_TIERS, base_file=CSV_FILE):
+        self.tiers = tiers
+        self.lock = threading.Lock()
+        base = os.path.splitext(base_file)[0]
+        self.files = {name: f"{base}_rollup_{name}.csv" for name, _ in tiers}
+        self.closed = {name: {} for name, _ in tiers}  # рівень -> продукт -> deque бакетів
+        self.open = {name: {} for name, _ in tiers}  # рівень -> продукт -> поточний бакет
+        self.last_qty = {}
+        self.load()
+
+    def load(self):
+        """Читає збережені агрегати поруч з сирим логом"""
+        for name, _ in self.tiers:
+            if not os.path.exists(self.files[name]):
+                continue
+            with open(self.files[name], 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    try:
+                        bucket = {
+                            'start': int(row['bucket_start']),
+                            'min': int(row['min']),
+                            'max': int(row['max']),
+                            'last': int(row['last']),
+                            'sold': int(row['sold']),
+                        }
+                        product_id = int(row['product_id'])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    self.append_closed(name, product_id, bucket)
+
+        # Продовжуємо рахувати продажі від останнього збереженого значення;
+        # найдрібніший рівень першим, бо його останній бакет найсвіжіший
+        for name, _ in self.tiers:
+            for product_id, buckets in self.closed[name].items():
+                if buckets:
+                    self.last_qty.setdefault(product_id, buckets[-1]['last'])
+
+    def append_closed(self, name, product_id, bucket):
+        """Додає закритий бакет; бакет того ж інтервалу (після перезапуску) зливається"""
+        buckets = self.closed[name].setdefault(product_id, deque(maxlen=ROLLUP_MAX_BUCKETS))
+        if buckets and buckets[-1]['start'] == bucket['start']:
+            previous = buckets[-1]
+            previous['min'] = min(previous['min'], bucket['min'])
+            previous['max'] = max(previous['max'], bucket['max'])
+            previous['last'] = bucket['last']
+            previous['sold'] += bucket['sold']
+        else:
+            buckets.append(bucket)
+
+    def add(self, product_id, timestamp, qty):
+        """Враховує новий семпл у всіх рівнях"""
+        with self.lock:
+            previous = self.last_qty.get(product_id)
+            sold = previous - qty if previous is not None and qty < previous else 0
+            self.last_qty[product_id] = qty
+
+            for name, seconds in self.tiers:
+                start = int(timestamp // seconds * seconds)
+                bucket = self.open[name].get(product_id)
+                if bucket is not None and bucket['start'] != start:
+                    self.close_bucket(name, product_id, bucket)
+                    bucket = None
+
+                if bucket is None:
+                    bucket = {'start': start, 'min': qty, 'max': qty, 'last': qty, 'sold': 0}
+                    self.open[name][product_id] = bucket
+
+                bucket['min'] = min(bucket['min'], qty)
+                bucket['max'] = max(bucket['max'], qty)
+                bucket['last'] = qty
+                bucket['sold'] += sold
+
+    def close_bucket(self, name, product_id, bucket):
+        """Закриває бакет і дописує його у файл рівня"""
+        self.append_closed(name, product_id, dict(bucket))
+        self.open[name].pop(product_id, None)
+
+        path = self.files[name]
+        file_exists = os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(self.FIELDS)
+            writer.writerow([
+                bucket['start'],
+                datetime.fromtimestamp(bucket['start']).strftime('%d.%m.%Y %H:%M:%S'),
+                product_id, bucket['min'], bucket['max'], bucket['last'], bucket['sold']
+            ])
+
+    def flush(self):
+        """Закриває всі відкриті бакети (кінець сесії)"""
+        with self.lock:
+            for name, _ in self.tiers:
+                for product_id, bucket in list(self.open[name].items()):
+                    self.close_bucket(name, product_id, bucket)
+
+    def pick_tier(self, product_id, start, end, max_points):
+        """Найдрібніший рівень, що вкладає вікно в max_points точок і ще покриває його початок"""
+        for name, seconds in self.tiers:
+            if (end - start) / seconds > max_points:
+                continue
+            buckets = self.closed[name].get(product_id)
+            if buckets and len(buckets) == buckets.maxlen and buckets[0]['start'] > start:
+                continue  # Старі бакети цього рівня вже витіснені з пам'яті
+            return name
+        return self.tiers[-1][0]
+
+    def query(self, product_id, start, end, max_points=GRAPH_MAX_POINTS):
+        """Повертає (рівень, бакети) для вікна [start, end]"""
+        with self.lock:
+            name = self.pick_tier(product_id, start, end, max_points)
+            seconds = dict(self.tiers)[name]
+            buckets = [dict(b) for b in self.closed[name].get(product_id, ())
+                       if b['start'] + seconds > start and b['start'] <= end]
+
+            bucket = self.open[name].get(product_id)
+            if bucket is not None and bucket['start'] <= end:
+                if buckets and buckets[-1]['start'] == bucket['start']:
+                    buckets.pop()  # Відкритий бакет після перезапуску - вже включає закриту частину
+                    merged = dict(self.closed[name][product_id][-1])
+                    merged['min'] = min(merged['min'], bucket['min'])
+                    merged['max'] = max(merged['max'], bucket['max'])
+                    merged['last'] = bucket['last']
+                    merged['sold'] += bucket['sold']
+                    buckets.append(merged)
+                else:
+                    buckets.append(dict(bucket))
+            return name, buckets
+
+
+# === СИМУЛЯЦІЯ ТА СТРЕС-РЕЖИМ ===
+
+class SimulatedInventory:
+    """Синтетичне джерело інвентаря з тим же форматом даних, що й request_inventory"""
+
+    PATTERNS = ['steady', 'drop', 'restock']
+
+    def __init__(self, product_count, seed=None):
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.products = {}
+        now = time.time()
+
+        for i in range(product_count):
+            max_qty = self.random.randint(500, 5000)
+            # Базовий темп: за всю сесію розпродається частина запасу
+            rate = max_qty / (MONITOR_DURATION_MINUTES * 60) * self.random.uniform(0.2, 1.0)
+            self.products[SIMULATED_ID_BASE + i] = {
+                'number': i + 1,
+                'pattern': self.PATTERNS[i % len(self.PATTERNS)],
+                'max_qty': max_qty,
+                'qty': float(max_qty),
+                'rate': rate,
+                'drop_at': now + self.random.uniform(30, 300),
+                'restock_every': self.random.uniform(120, 600),
+                'last_restock': now,
+                'last_time': now,
+            }
+
+    @property
+    def product_ids(self):
+        return list(self.products.keys())
+
+    def fetch_metadata(self, product_ids):
+        """Метадані для каталогу (замість storefront)"""
+        return {
+            pid: {'name': f"Simulated #{self.products[pid]['number']} ({self.products[pid]['pattern']})",
+                  'image_url': None}
+            for pid in product_ids if pid in self.products
+        }
+
+    def get_inventory(self, token, product_id, user_agent=None):
+        """Наступне значення кривої продукту станом на зараз"""
+        with self.lock:
+            product = self.products.get(product_id)
+            if product is None:
+                return None
+
+            now = time.time()
+            demand = product['rate'] * (now - product['last_time'])
+            product['last_time'] = now
+
+            if product['pattern'] == 'drop' and now >= product['drop_at']:
+                demand *= 300  # Дроп: запас розлітається за лічені хвилини
+            elif product['pattern'] == 'restock':
+                demand *= 5
+                if now - product['last_restock'] >= product['restock_every']:
+                    product['qty'] = float(product['max_qty'])
+                    product['last_restock'] = now
+
+            # Шум попиту навколо очікуваного значення
+            sold = max(0.0, self.random.gauss(demand, demand ** 0.5))
+            product['qty'] = max(0.0, product['qty'] - sold)
+
+            return {
+                'totalInventory': int(product['qty']),
+                'variantMeta': '[]',
+                'maxQuantity': product['max_qty'],
+                'timestamp': now,
+                'product_id': product_id
+            }
+
+
+class StressMonitor:
+    """Затримка циклу подій Tk, час перемальовки колонок, тривалість перевірок і пам'ять"""
+
+    def __init__(self, root, check_interval, report_seconds=STRESS_REPORT_SECONDS,
+                 probe_ms=STRESS_PROBE_MS, on_report=None):
+        self.root = root
+        self.check_interval = check_interval
+        self.report_seconds = report_seconds
+        self.probe_ms = probe_ms
+        self.on_report = on_report
+        self.lock = threading.Lock()
+        self.lags = []
+        self.redraws = {}
+        self.cycles = []
+        self.expected = None
+        self.next_report = None
+
+    def start(self):
+        """Запускає періодичну пробу циклу подій"""
+        self.next_report = time.perf_counter() + self.report_seconds
+        self.schedule_probe()
+
+    def schedule_probe(self):
+        self.expected = time.perf_counter() + self.probe_ms / 1000
+        self.root.after(self.probe_ms, self.probe)
+
+    def probe(self):
+        """Наскільки пізніше запланованого Tk виконав колбек"""
+        now = time.perf_counter()
+        self.lags.append(max(0.0, now - self.expected))
+        if now >= self.next_report:
+            self.report()
+            self.next_report = now + self.report_seconds
+        self.schedule_probe()
+
+    def record_redraw(self, column_idx, seconds):
+        """Час перемальовки графіка колонки (викликається в потоці Tk)"""
+        self.redraws.setdefault(column_idx, []).append(seconds)
+
+    def record_cycle(self, seconds):
+        """Тривалість однієї перевірки всіх продуктів (потік моніторингу)"""
+        with self.lock:
+            self.cycles.append(seconds)
+
+    def report(self):
+        """Виводить зведення за інтервал і скидає лічильники"""
+        lags = sorted(self.lags)
+        with self.lock:
+            cycles = self.cycles
+            self.cycles = []
+        redraws = self.redraws
+        self.lags = []
+        self.redraws = {}
+
+        lag_p95 = lags[int(len(lags) * 0.95)] * 1000 if lags else 0
+        lag_max = lags[-1] * 1000 if lags else 0
+        all_redraws = [t for times in redraws.values() for t in times]
+        redraw_avg = sum(all_redraws) / len(all_redraws) * 1000 if all_redraws else 0
+        slowest = max(redraws.items(), key=lambda item: max(item[1]), default=None)
+        cycle_max = max(cycles) if cycles else 0
+
+        stats = process_stats()
+        if stats:
+            memory = f"RSS {stats['rss'] / 1024 / 1024:.0f} MB"
+        elif tracemalloc.is_tracing():
+            memory = f"traced {tracemalloc.get_traced_memory()[0] / 1024 / 1024:.0f} MB"
+        else:
+            memory = "mem n/a"
+
+        behind = " ⚠️ BEHIND" if cycle_max > self.check_interval or lag_p95 > self.check_interval * 1000 else ""
+        message = (f"Tk lag p95 {lag_p95:.0f} ms / max {lag_max:.0f} ms | "
+                   f"redraw avg {redraw_avg:.0f} ms ({len(all_redraws)}x)")
+        if slowest:
+            message += f", slowest col {slowest[0] + 1}: {max(slowest[1]) * 1000:.0f} ms"
+        message += f" | cycle {cycle_max:.2f}s / {self.check_interval}s | {memory}{behind}"
+
+        print(f"[stress] {message}")
+        if self.on_report:
+            self.on_report(message)
+
+
+# === ПРОФІЛЮВАННЯ ===
+
+class Profiler:
+    """Семплюючий CPU-профайлер і tracemalloc-знімки для довгих сесій"""
+
+    def __init__(self, output_dir=PROFILE_DIR, sample_interval=PROFILE_SAMPLE_INTERVAL,
+                 report_seconds=PROFILE_REPORT_SECONDS):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.report_seconds = report_seconds
+        self.running = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.leaf_samples = Counter()
+        self.stack_samples = Counter()
+        self.thread_samples = Counter()
+        self.sample_count = 0
+        self.thread_cpu = {}
+        self.started_tracing = False
+        self.previous_snapshot = None
+        self.cpu_log = None
+        self.memory_log = None
+
+    def make_logger(self, name):
+        """Логер з ротацією файлів у output_dir"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        logger = logging.getLogger(f'profiler.{name}')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if not logger.handlers:
+            handler = RotatingFileHandler(
+                os.path.join(self.output_dir, f'{name}.log'),
+                maxBytes=PROFILE_LOG_MAX_BYTES,
+                backupCount=PROFILE_LOG_BACKUPS,
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            logger.addHandler(handler)
+        return logger
+
+    def start(self):
+        """Запускає профілювання"""
+        if self.running:
+            return
+        self.cpu_log = self.make_logger('cpu')
+        self.memory_log = self.make_logger('memory')
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self.started_tracing = True
+        self.previous_snapshot = self.take_snapshot()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"Профілювання увімкнено, звіти в {self.output_dir}")
+
+    def stop(self):
+        """Зупиняє профілювання і пише фінальний звіт"""
+        if not self.running:
+            return
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.write_report()
+        # Трасування, увімкнене ззовні (PYTHONTRACEMALLOC), не чіпаємо
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.previous_snapshot = None
+        print("Профілювання вимкнено")
+
+    def toggle(self):
+        """Перемикає профілювання, повертає новий стан"""
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+        return self.running
+
+    def busy_threads(self):
+        """ID потоків, чий CPU-час зріс з попереднього семплу (None - без psutil)"""
+        if psutil is None:
+            return None
+
+        try:
+            cpu = {t.id: t.user_time + t.system_time for t in psutil.Process().threads()}
+        except psutil.Error:
+            return None
+
+        busy = set()
+        for thread in threading.enumerate():
+            total = cpu.get(thread.native_id)
+            if total is None:
+                continue
+            if total > self.thread_cpu.get(thread.native_id, total):
+                busy.add(thread.ident)
+            self.thread_cpu[thread.native_id] = total
+        return busy
+
+    def run(self):
+        """Цикл семплювання стеків потоків, що зараз витрачають CPU"""
+        own_id = threading.get_ident()
+        next_report = time.time() + self.report_seconds
+
+        while self.running:
+            busy = self.busy_threads()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            with self.lock:
+                for thread_id, frame in sys._current_frames().items():
+                    # Потоки в sleep/wait/mainloop CPU не витрачають - пропускаємо
+                    if thread_id == own_id or (busy is not None and thread_id not in busy):
+                        continue
+                    self.thread_samples[names.get(thread_id, str(thread_id))] += 1
+                    code = frame.f_code
+                    self.leaf_samples[f"{code.co_filename}:{frame.f_lineno} {code.co_name}"] += 1
+
+                    # Кумулятивно: кожна функція стеку один раз
+                    seen = set()
+                    while frame is not None:
+                        code = frame.f_code
+                        key = f"{code.co_filename}:{code.co_firstlineno} {code.co_name}"
+                        if key not in seen:
+                            seen.add(key)
+                            self.stack_samples[key] += 1
+                        frame = frame.f_back
+                self.sample_count += 1
+
+            if time.time() >= next_report:
+                self.write_report()
+                next_report = time.time() + self.report_seconds
+
+            time.sleep(self.sample_interval)
+
+    def take_snapshot(self):
+        """Знімок tracemalloc без службових алокацій"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def write_report(self):
+        """Пише топ CPU за інтервал та приріст пам'яті з попереднього знімка"""
+        with self.lock:
+            leaf = self.leaf_samples.most_common(PROFILE_TOP_N)
+            stack = self.stack_samples.most_common(PROFILE_TOP_N)
+            threads = self.thread_samples.most_common()
+            ticks = self.sample_count
+            self.leaf_samples = Counter()
+            self.stack_samples = Counter()
+            self.thread_samples = Counter()
+            self.sample_count = 0
+
+        # Відсотки - від суми семплів зайнятих потоків, тому разом не більше 100%
+        total = max(sum(count for _, count in threads), 1)
+        mode = "busy threads only" if psutil is not None else "wall-clock, install psutil for CPU-only"
+        lines = [f"=== CPU: {ticks} ticks every {self.sample_interval}s, {mode} ===", "-- threads --"]
+        lines += [f"{count / total:7.1%}  {name}" for name, count in threads]
+        lines.append("-- self --")
+        lines += [f"{count / total:7.1%}  {key}" for key, count in leaf]
+        lines.append("-- cumulative --")
+        lines += [f"{count / total:7.1%}  {key}" for key, count in stack]
+        self.cpu_log.info('\n'.join(lines))
+
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = self.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"=== MEMORY: traced {current / 1024 / 1024:.1f} MB (peak {peak / 1024 / 1024:.1f} MB) ==="]
+
+        stats = process_stats()
+        if stats:
+            lines.append(f"RSS {stats['rss'] / 1024 / 1024:.1f} MB, child processes: {len(stats['children'])}")
+            for pid, name, rss in stats['children']:
+                lines.append(f"  child {pid} {name}: {rss / 1024 / 1024:.1f} MB")
+        else:
+            lines.append("RSS/child processes: install psutil to track")
+
+        lines.append("-- top growth --")
+        if self.previous_snapshot is not None:
+            for stat in snapshot.compare_to(self.previous_snapshot, 'lineno')[:PROFILE_TOP_N]:
+                lines.append(str(stat))
+        self.previous_snapshot = snapshot
+        self.memory_log.info('\n'.join(lines))
+
+
+def process_stats():
+    """RSS поточного процесу та його дочірні процеси (Playwright/Chromium)"""
+    if psutil is None:
+        return None
+
+    proc = psutil.Process()
+    children = []
+    for child in proc.children(recursive=True):
+        try:
+            children.append((child.pid, child.name(), child.memory_info().rss))
+        except psutil.Error:
+            continue
+    return {'rss': proc.memory_info().rss, 'children': children}
+
+
+# === ХЕДЖУВАННЯ ЗАПИТІВ ===
+
+class LatencyTracker:
+    """Ковзне вікно затримок успішних відповідей і поріг для дубля запиту (p95)"""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+
+    def record(self, elapsed):
+        """Враховує затримку успішної відповіді (зокрема тієї, що програла гонку)"""
+        with self.lock:
+            self.samples.append(elapsed)
+
+    def cutoff(self):
+        """Через скільки секунд без відповіді відправляти дубль"""
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_CUTOFF
+            samples = sorted(self.samples)
+        p95 = samples[int(len(samples) * 0.95)]
+        return min(max(p95, HEDGE_MIN_CUTOFF), REQUEST_TIMEOUT / 2)
+
+
+# === ДОПОМІЖНІ ФУНКЦІЇ ===
+
+def write_json_atomic(path, data):
+    """Атомарний запис JSON: тимчасовий файл поруч + rename"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def token_file_lock(token_file):
+    """Ексклюзивний advisory-лок на файл токена (спільний для всіх процесів)"""
+    with open(token_file + '.lock', 'a+') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK здається після ~10 с, чекаємо далі
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_token_data(token_file=TOKEN_FILE):
+    """Вміст файлу токена ({} якщо файлу немає або він битий)"""
+    # Файл замінюється атомарно, тому читання не потребує локу
+    try:
+        with open(token_file, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Помилка читання токена {token_file}: {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def load_token(token_file=TOKEN_FILE):
+    data = read_token_data(token_file)
+    try:
+        # Файл може містити лише мітку невдалого оновлення без токена
+        if data.get('token') and time.time() - data['updated'] < TOKEN_CACHE_SECONDS:
+            return data['token']
+    except (KeyError, TypeError) as e:
+        print(f"Помилка читання токена {token_file}: {e}")
     return None
 
 
-def save_token(token):
+def save_token(token, token_file=TOKEN_FILE):
     data = {'token': token, 'updated': time.time()}
-    with open(TOKEN_FILE, 'w') as f:
-        json.dump(data, f)
+    write_json_atomic(token_file, data)
+
+
+def refresh_shared_token(token_file=TOKEN_FILE, profile=None, stale_token=None):
+    """Оновлює токен так, щоб браузер запускав лише один процес-лідер.
 
+    Лідером стає процес, що першим захопив лок. Решта чекають на лоці,
+    а після його звільнення отримують вже свіжий токен з файлу. Якщо лідер
+    не зміг отримати токен, він лишає мітку failed_at, і протягом
+    TOKEN_REFRESH_BACKOFF_SECONDS інші процеси браузер повторно не запускають.
+    """
+    with token_file_lock(token_file):
+        token = load_token(token_file)
+        if token and token != stale_token:
+            return token
+
+        data = read_token_data(token_file)
+        failed_at = data.get('failed_at')
+        if isinstance(failed_at, (int, float)) and time.time() - failed_at < TOKEN_REFRESH_BACKOFF_SECONDS:
+            return None
+
+        token = get_token_with_playwright(profile)
+        if token:
+            save_token(token, token_file)
+        else:
+            data['failed_at'] = time.time()
+            write_json_atomic(token_file, data)
+        return token
 
-def get_token_with_playwright():
+
+def get_token_with_playwright(profile=None):
+    profile = profile or BROWSER_PROFILES[0]
     try:
         with sync_playwright() as p:
             browser = p.chromium.launch(
@@ -683,8 +1716,8 @@ def get_token_with_playwright():
                 args=['--disable-blink-features=AutomationControlled']
             )
             context = browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+                viewport=profile['viewport'],
+                user_agent=profile['user_agent']
             )
             page = context.new_page()
 
@@ -710,64 +1743,156 @@ def get_token_with_playwright():
         return None
 
 
-def get_inventory(token, product_id):
+def request_inventory(token, product_id, user_agent=None):
+    """Запит інвентаря з класифікацією результату: (data, status, elapsed).
+
+    status: 'ok'; 'failed' - 401/403, токен треба оновити;
+    'slow' - таймаут або мережа; 'error' - 429, 5xx, порожні чи биті дані.
+    Лише 'failed' призводить до оновлення токена.
+    """
     url = "https://mattel-checkout-prd.fly.dev/api/product-inventory"
     querystring = {"productIds": f"gid://shopify/Product/{product_id}"}
     headers = {
         "Authorization": token,
         "Content-Type": "application/json",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
+        "User-Agent": user_agent or BROWSER_PROFILES[0]['user_agent']
     }
 
+    started = time.perf_counter()
     try:
         response = requests.get(url, headers=headers, params=querystring, timeout=REQUEST_TIMEOUT)
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                # Парсимо variantMeta для отримання max_qty
-                max_qty = 0
-                try:
-                    variant_meta = data[0].get('variantMeta', {}).get('value', '[]')
-                    variant_data = json.loads(variant_meta)
-
-                    # Проходимо по варіантах
-                    for variant in variant_data:
-                        variant_inventory = variant.get('variant_inventory', [])
-
-                        # Шукаємо максимальну кількість з варіантів
-                        # Пріоритет: Available → Backordered
-                        for entry in variant_inventory:
-                            if entry.get("variant_inventorystatus") == "Available":
-                                qty = entry.get("variant_qty", 0) or 0
-                                max_qty = int(qty)
-                                break  # Available має найвищий пріоритет
-
-                        # Якщо знайшли Available, виходимо
-                        if max_qty > 0:
-                            break
+    except (requests.Timeout, requests.ConnectionError):
+        return None, 'slow', time.perf_counter() - started
+    except requests.RequestException:
+        return None, 'error', time.perf_counter() - started
+    elapsed = time.perf_counter() - started
 
-                        # Якщо немає Available, шукаємо Backordered
-                        for entry in variant_inventory:
-                            if entry.get("variant_inventorystatus") == "Backordered":
-                                qty = entry.get("variant_qty", 0) or 0
-                                max_qty = int(qty)
-                                break
+    if response.status_code in (401, 403):
+        return None, 'failed', elapsed
+
+    try:
+        data = parse_inventory(response, product_id)
+    except Exception:
+        data = None
+
+    # Порожня відповідь 200 - токен прийнято, проблема в даних, а не в авторизації
+    if data is None or data.get('totalInventory') is None:
+        return None, 'error', elapsed
+    return data, 'ok', elapsed
+
+
+def parse_inventory(response, product_id):
+    if response.status_code == 200:
+        data = response.json()
+        if data and len(data) > 0:
+            # Парсимо variantMeta для отримання max_qty
+            max_qty = 0
+            try:
+                variant_meta = data[0].get('variantMeta', {}).get('value', '[]')
+                variant_data = json.loads(variant_meta)
+
+                # Проходимо по варіантах
+                for variant in variant_data:
+                    variant_inventory = variant.get('variant_inventory', [])
+
+                    # Шукаємо максимальну кількість з варіантів
+                    # Пріоритет: Available → Backordered
+                    for entry in variant_inventory:
+                        if entry.get("variant_inventorystatus") == "Available":
+                            qty = entry.get("variant_qty", 0) or 0
+                            max_qty = int(qty)
+                            break  # Available має найвищий пріоритет
+
+                    # Якщо знайшли Available, виходимо
+                    if max_qty > 0:
+                        break
 
-                        if max_qty > 0:
+                    # Якщо немає Available, шукаємо Backordered
+                    for entry in variant_inventory:
+                        if entry.get("variant_inventorystatus") == "Backordered":
+                            qty = entry.get("variant_qty", 0) or 0
+                            max_qty = int(qty)
                             break
-                except Exception as e:
-                    print(f"Error parsing variantMeta: {e}")
-
-                return {
-                    'totalInventory': data[0].get('totalInventory'),
-                    'variantMeta': data[0].get('variantMeta', {}).get('value', '[]'),
-                    'maxQuantity': max_qty,
-                    'timestamp': time.time(),
-                    'product_id': product_id
-                }
-        return None
-    except:
-        return None
+
+                    if max_qty > 0:
+                        break
+            except Exception as e:
+                print(f"Error parsing variantMeta: {e}")
+
+            return {
+                'totalInventory': data[0].get('totalInventory'),
+                'variantMeta': data[0].get('variantMeta', {}).get('value', '[]'),
+                'maxQuantity': max_qty,
+                'timestamp': time.time(),
+                'product_id': product_id
+            }
+    return None
+
+
+def get_inventory_hedged(token_pool, product_id, latency):
+    """Запит з хеджуванням: дубль з іншим токеном, якщо перший не відповів за p95.
+
+    Перемагає перша успішна відповідь; запит, що програв, дочікується у фоні.
+    Дубль відправляється лише коли в HEDGE_EXECUTOR є вільний потік, щоб він
+    не стояв у черзі, поки йде відлік порогу.
+    Повертає (data, failed_tokens) - токени, що отримали 401/403.
+    """
+    token, user_agent = token_pool.acquire()
+    if not token:
+        return None, []
+
+    futures = {}
+
+    def settle(token, status, elapsed):
+        if status == 'ok':
+            latency.record(elapsed)
+        elif status == 'failed':
+            # Єдине місце, що запускає оновлення; спрацьовує і для запізнілих відмов
+            token_pool.report_failure(token)
+            token_pool.refresh_in_background()
+
+    def on_done(future, token):
+        HEDGE_SLOTS.release()
+        _, status, elapsed = future.result()
+        settle(token, status, elapsed)
+
+    def submit(token, user_agent):
+        if not HEDGE_SLOTS.acquire(blocking=False):
+            return False
+        future = HEDGE_EXECUTOR.submit(request_inventory, token, product_id, user_agent)
+        futures[future] = token
+        future.add_done_callback(lambda f: on_done(f, token))
+        return True
+
+    if not submit(token, user_agent):
+        # Усі потоки зайняті повільними запитами - основний запит без дубля
+        data, status, elapsed = request_inventory(token, product_id, user_agent)
+        settle(token, status, elapsed)
+        return data, [token] if status == 'failed' else []
+
+    done, _ = wait(futures, timeout=latency.cutoff())
+    if not done:
+        hedge_token, hedge_user_agent = token_pool.acquire()
+        if hedge_token:
+            submit(hedge_token, hedge_user_agent)
+
+    result = None
+    failed_tokens = []
+    pending = set(futures)
+    while pending and result is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # Обробляємо всі завершені, щоб не загубити відмову поруч з успіхом
+        for future in done:
+            data, status, _ = future.result()
+            if status == 'ok' and result is None:
+                result = data
+            elif status == 'failed':
+                # wait() може повернутись раніше за колбек - позначаємо токен одразу,
+                # щоб повтор не взяв його знову (оновлення запускає лише колбек)
+                token_pool.report_failure(futures[future])
+                failed_tokens.append(futures[future])
+
+    return result, failed_tokens
 
 
 def init_csv():
@@ -778,11 +1903,11 @@ def init_csv():
             writer.writerow(['time', 'product_id', 'product_name', 'qty', 'max_qty', 'change', 'variant_info'])
 
 
-def log_inventory(data, previous_qty, product_id):
+def log_inventory(data, previous_qty, product_id, product_name):
     timestamp = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
     qty = data.get('totalInventory', 0)
     max_qty = data.get('maxQuantity', 0)
-    product_name = PRODUCTS.get(product_id, {}).get('name', 'Unknown').replace('\n', ' ')
+    product_name = product_name.replace('\n', ' ')
 
     change = ''
     if previous_qty is not None:
@@ -805,8 +1930,87 @@ def log_inventory(data, previous_qty, product_id):
     return qty
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Mattel Multi-Product Inventory Monitor')
+    parser.add_argument('--watchlist', default='default',
+                        help=f'watchlist name from {WATCHLIST_FILE}')
+    parser.add_argument('--catalog-source', choices=['storefront', 'local'], default='storefront',
+                        help='where to fetch product names/images (local = built-in metadata, no network)')
+    parser.add_argument('--simulate', type=int, metavar='N',
+                        help='poll N synthetic products instead of the live API (all are polled, --columns are drawn)')
+    parser.add_argument('--seed', type=int, help='random seed for --simulate')
+    parser.add_argument('--interval', type=float, default=CHECK_INTERVAL_SECONDS,
+                        help='seconds between checks')
+    parser.add_argument('--columns', type=int,
+                        help='number of product columns to draw (default: 3)')
+    parser.add_argument('--stress', action='store_true',
+                        help='report Tk event-loop lag, redraw time and memory; auto-starts monitoring')
+    parser.add_argument('--profile', action='store_true',
+                        help='enable CPU/memory profiling from start (toggle at runtime with Ctrl+P or SIGUSR1)')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR,
+                        help='directory for rotating profiler reports')
+    parser.add_argument('--profile-interval', type=int, default=PROFILE_REPORT_SECONDS,
+                        help='seconds between profiler reports')
+    return parser.parse_args()
+
+
 # === ЗАПУСК GUI ===
 if __name__ == '__main__':
+    args = parse_args()
+
+    simulation = None
+    if args.simulate:
+        # Симуляція пише в окремі файли, щоб не змішувати з реальною історією
+        CSV_FILE = SIM_CSV_FILE
+        simulation = SimulatedInventory(args.simulate, seed=args.seed)
+        catalog = Catalog(simulation.product_ids, fetcher=simulation.fetch_metadata,
+                          cache_file=SIM_CATALOG_CACHE_FILE)
+        catalog.refresh()
+    else:
+        watchlists = load_watchlists()
+        if args.watchlist not in watchlists:
+            sys.exit(f"Unknown watchlist '{args.watchlist}', available: {', '.join(watchlists)}")
+        catalog = Catalog(
+            watchlists[args.watchlist],
+            fetcher=fetch_local_metadata if args.catalog_source == 'local' else fetch_storefront_metadata
+        )
+    rollups = RollupStore(base_file=CSV_FILE)
+
+    profiler = Profiler(args.profile_dir, report_seconds=args.profile_interval)
+    if args.profile:
+        profiler.start()
+
     root = tk.Tk()
-    app = InventoryMonitorGUI(root)
-    root.mainloop()
\ No newline at end of file
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle())
+
+        # Обробник сигналу виконується лише коли головний потік виконує Python-код,
+        # тому періодично "будимо" mainloop навіть без подій GUI
+        def wake_for_signals():
+            root.after(SIGNAL_POLL_MS, wake_for_signals)
+
+        wake_for_signals()
+
+    stress = StressMonitor(root, args.interval) if args.stress else None
+    app = InventoryMonitorGUI(
+        root, catalog, rollups,
+        profiler=profiler,
+        simulation=simulation,
+        stress=stress,
+        column_count=args.columns or 3,
+        check_interval=args.interval
+    )
+    # Фонове оновлення - лише коли GUI вже підписався на зміни каталогу
+    if simulation is None:
+        catalog.start_background_refresh()
+    if stress is not None:
+        stress.on_report = lambda message: app.update_status(f"📈 {message}", '#9C27B0')
+        stress.start()
+        root.after(500, app.start_monitoring)
+    root.mainloop()
+
+    # Вікно закрито посеред моніторингу - зупиняємо потік і зберігаємо відкриті бакети
+    app.monitoring = False
+    rollups.flush()
+    profiler.stop()
\ No newline at end of file